@@ -9,11 +9,13 @@ class A2CAlgo(BaseAlgo):
 
     def __init__(self, envs, acmodel, device=None, num_frames_per_proc=None, discount=0.99, lr=0.01, gae_lambda=0.95,
                  entropy_coef=0.01, value_loss_coef=0.5, max_grad_norm=0.5, recurrence=4,
-                 rmsprop_alpha=0.99, rmsprop_eps=1e-8, preprocess_obss=None, reshape_reward=None):
+                 rmsprop_alpha=0.99, rmsprop_eps=1e-8, preprocess_obss=None, reshape_reward=None, envs_per_process=1,
+                 local_rank=0, world_size=1):
         num_frames_per_proc = num_frames_per_proc or 8
 
         super().__init__(envs, acmodel, device, num_frames_per_proc, discount, lr, gae_lambda, entropy_coef,
-                         value_loss_coef, max_grad_norm, recurrence, preprocess_obss, reshape_reward)
+                         value_loss_coef, max_grad_norm, recurrence, preprocess_obss, reshape_reward,
+                         envs_per_process, local_rank, world_size)
 
         self.optimizer = torch.optim.RMSprop(self.acmodel.parameters(), lr,
                                              alpha=rmsprop_alpha, eps=rmsprop_eps)
@@ -44,9 +46,9 @@ class A2CAlgo(BaseAlgo):
             # Compute loss
 
             if self.acmodel.recurrent:
-                dist, value, memory = self.acmodel(sb.obs, memory * sb.mask)
+                dist, value, memory = self.ddp_acmodel(sb.obs, memory * sb.mask)
             else:
-                dist, value = self.acmodel(sb.obs)
+                dist, value = self.ddp_acmodel(sb.obs)
 
             entropy = dist.entropy().mean()
 
@@ -1,16 +1,87 @@
 from abc import ABC, abstractmethod
+from collections import deque
 
+import numpy
 import torch
 
 from torch_ac.format import default_preprocess_obss
 from torch_ac.utils import DictList, ParallelEnv
 
+# Rows of the per-step staging buffer
+
+STAGE_REWARD = 0
+STAGE_MESSES = 1
+STAGE_PERFORMANCE_FULL = 2
+STAGE_PERFORMANCE = 3
+STAGE_BUTTON_PRESSES = 4
+STAGE_PHONES_CLEANED = 5
+STAGE_DIRT_CLEANED = 6
+STAGE_MASK = 7
+NUM_STAGES = 8
+
+# Staging rows of the values read from the env infos, by info key
+
+INFO_STAGES = {
+    'messes_cleaned': STAGE_MESSES,
+    'performance_full': STAGE_PERFORMANCE_FULL,
+    'performance': STAGE_PERFORMANCE,
+    'button_presses': STAGE_BUTTON_PRESSES,
+    'phones_cleaned': STAGE_PHONES_CLEANED,
+    'dirt_cleaned': STAGE_DIRT_CLEANED,
+}
+
+# Rows of the per-episode log values. The first rows line up with the
+# staging rows they are accumulated from.
+
+LOG_RETURN = STAGE_REWARD
+LOG_RETURN_MESSES = STAGE_MESSES
+LOG_RETURN_PERFORMANCE_FULL = STAGE_PERFORMANCE_FULL
+LOG_RETURN_PERFORMANCE = STAGE_PERFORMANCE
+LOG_RETURN_BUTTON_PRESSES = STAGE_BUTTON_PRESSES
+LOG_RETURN_PHONES_CLEANED = STAGE_PHONES_CLEANED
+LOG_RETURN_DIRT_CLEANED = STAGE_DIRT_CLEANED
+LOG_RESHAPED_RETURN = 7
+LOG_RESHAPED_RETURN_PERFORMANCE = 8
+LOG_RESHAPED_RETURN_BUTTON_PRESSES = 9
+LOG_RESHAPED_RETURN_PHONES_CLEANED = 10
+LOG_RESHAPED_RETURN_DIRT_CLEANED = 11
+LOG_NUM_FRAMES = 12
+NUM_LOGS = 13
+
+
+def _log_episode_row(index):
+    return property(lambda self: self.log_episode[index])
+
+
+def _obs_fields(preprocessed_obs):
+    """Returns the tensors of preprocessed observations, keyed by field
+    name, or by `None` if they are a single tensor."""
+
+    if isinstance(preprocessed_obs, dict):
+        return dict(preprocessed_obs)
+    return {None: preprocessed_obs}
+
 
 class BaseAlgo(ABC):
     """The base class for RL algorithms."""
 
+    log_episode_return = _log_episode_row(LOG_RETURN)
+    log_episode_return_MESSES = _log_episode_row(LOG_RETURN_MESSES)
+    log_episode_return_PERFORMANCE_FULL = _log_episode_row(LOG_RETURN_PERFORMANCE_FULL)
+    log_episode_return_PERFORMANCE = _log_episode_row(LOG_RETURN_PERFORMANCE)
+    log_episode_return_BUTTON_PRESSES = _log_episode_row(LOG_RETURN_BUTTON_PRESSES)
+    log_episode_return_PHONES_CLEANED = _log_episode_row(LOG_RETURN_PHONES_CLEANED)
+    log_episode_return_DIRT_CLEANED = _log_episode_row(LOG_RETURN_DIRT_CLEANED)
+    log_episode_reshaped_return = _log_episode_row(LOG_RESHAPED_RETURN)
+    log_episode_reshaped_return_PERFORMANCE = _log_episode_row(LOG_RESHAPED_RETURN_PERFORMANCE)
+    log_episode_reshaped_return_BUTTON_PRESSES = _log_episode_row(LOG_RESHAPED_RETURN_BUTTON_PRESSES)
+    log_episode_reshaped_return_PHONES_CLEANED = _log_episode_row(LOG_RESHAPED_RETURN_PHONES_CLEANED)
+    log_episode_reshaped_return_DIRT_CLEANED = _log_episode_row(LOG_RESHAPED_RETURN_DIRT_CLEANED)
+    log_episode_num_frames = _log_episode_row(LOG_NUM_FRAMES)
+
     def __init__(self, envs, acmodel, device, num_frames_per_proc, discount, lr, gae_lambda, entropy_coef,
-                 value_loss_coef, max_grad_norm, recurrence, preprocess_obss, reshape_reward):
+                 value_loss_coef, max_grad_norm, recurrence, preprocess_obss, reshape_reward, envs_per_process=1,
+                 local_rank=0, world_size=1):
         """
         Initializes a `BaseAlgo` instance.
 
@@ -42,12 +113,36 @@ class BaseAlgo(ABC):
             and converts them into the format that the model can handle
         reshape_reward : function
             a function that shapes the reward, takes an
-            (observation, action, reward, done) tuple as an input
+            (observation, action, reward, done) tuple as an input.
+            Not supported: it must be None
+        envs_per_process : int
+            the number of environments stepped by each process of the
+            `ParallelEnv`
+        local_rank : int
+            the rank of this process on its node. `device` should be the
+            GPU of this rank, e.g. `"cuda:{}".format(local_rank)`. It does
+            not need to be the current CUDA device: the rollout waits on the
+            streams of `device` itself, so calling
+            `torch.cuda.set_device(local_rank)` is not required, only
+            recommended for the caller's own CUDA work
+        world_size : int
+            the number of training processes. If greater than 1, the
+            default `torch.distributed` process group must already be
+            initialized (e.g. by a script launched with `torchrun`), each
+            process collects experiences from its own `envs`, seeded
+            differently by the caller, and gradients are averaged over all
+            processes
         """
 
+        # Reward shaping would not be applied to the reward components
+        # (performance, button presses, ...) that are logged
+
+        if reshape_reward is not None:
+            raise NotImplementedError("reward shaping is not supported")
+
         # Store parameters
 
-        self.env = ParallelEnv(envs)
+        self.env = ParallelEnv(envs, envs_per_process)
         self.acmodel = acmodel
         self.device = device
         self.num_frames_per_proc = num_frames_per_proc
@@ -60,34 +155,54 @@ class BaseAlgo(ABC):
         self.recurrence = recurrence
         self.preprocess_obss = preprocess_obss or default_preprocess_obss
         self.reshape_reward = reshape_reward
+        self.local_rank = local_rank
+        self.world_size = world_size
 
         # Control parameters
 
         assert self.acmodel.recurrent or self.recurrence == 1
         assert self.num_frames_per_proc % self.recurrence == 0
+        assert self.world_size == 1 or torch.distributed.is_initialized()
 
-        # Configure acmodel
+        # Configure acmodel: rollouts use `acmodel` directly, losses are
+        # computed with `ddp_acmodel` so that gradients are all-reduced
 
         self.acmodel.to(self.device)
         self.acmodel.train()
 
+        if self.world_size > 1:
+            device_ids = None
+            if self.device is not None and torch.device(self.device).type == "cuda":
+                # A plain "cuda" device puts the model on the current device
+                device_index = torch.device(self.device).index
+                if device_index is None:
+                    device_index = torch.cuda.current_device()
+                device_ids = [device_index]
+            self.ddp_acmodel = torch.nn.parallel.DistributedDataParallel(self.acmodel, device_ids=device_ids)
+        else:
+            self.ddp_acmodel = self.acmodel
+
         # Store helpers values
 
         self.num_procs = len(envs)
         self.num_frames = self.num_frames_per_proc * self.num_procs
 
-        # Initialize experience values
+        # Initialize experience values, stored process-major (P x T) so that
+        # they are flattened into experiences without any copy
 
-        shape = (self.num_frames_per_proc, self.num_procs)
+        shape = (self.num_procs, self.num_frames_per_proc)
 
         self.obs = self.env.reset()
-        self.obss = [None] * (shape[0])
+        self.preprocessed_obs = self.preprocess_obss(self.obs, device=self.device)
+        self.obss = [None] * (shape[1])
+        self.preprocessed_obss = {}
         if self.acmodel.recurrent:
-            self.memory = torch.zeros(shape[1], self.acmodel.memory_size, device=self.device)
+            self.memory = torch.zeros(shape[0], self.acmodel.memory_size, device=self.device)
             self.memories = torch.zeros(*shape, self.acmodel.memory_size, device=self.device)
-        self.mask = torch.ones(shape[1], device=self.device)
+            self._masked_memory = torch.empty_like(self.memory)
+        self.mask = torch.ones(shape[0], device=self.device)
         self.masks = torch.zeros(*shape, device=self.device)
-        self.actions = torch.zeros(*shape, device=self.device, dtype=torch.int)
+        self.actions = torch.zeros(*shape, device=self.device, dtype=torch.long)
         self.values = torch.zeros(*shape, device=self.device)
         self.rewards = torch.zeros(*shape, device=self.device)
         self.rewards_PERFORMANCE = torch.zeros(*shape, device=self.device)
@@ -97,39 +212,58 @@ class BaseAlgo(ABC):
         self.advantages = torch.zeros(*shape, device=self.device)
         self.log_probs = torch.zeros(*shape, device=self.device)
 
-        # Initialize log values
+        # Initialize staging buffers: the per-step rewards, done flags and
+        # info values are written into a single (pinned) host buffer and
+        # copied to the device at once
+
+        pin_memory = self.device is not None and torch.device(self.device).type == "cuda"
+        self._host_staging = torch.zeros(NUM_STAGES, self.num_procs, pin_memory=pin_memory)
+        self._host_staging_np = self._host_staging.numpy()
+        self._dev_staging = torch.zeros(NUM_STAGES, self.num_procs, device=self.device)
+
+        # Initialize the host action buffer: actions are copied into it
+        # asynchronously and `_action_copied` is waited on before stepping
 
-        self.log_episode_return_MESSES = torch.zeros(self.num_procs, device=self.device)
+        self._action_cpu = torch.zeros(self.num_procs, dtype=torch.long, pin_memory=pin_memory)
+        self._action_cpu_np = self._action_cpu.numpy()
+        self._action_copied = torch.cuda.Event() if pin_memory else None
 
-        self.log_episode_return_PERFORMANCE_FULL = torch.zeros(self.num_procs, device=self.device)
+        # The info keys given by the environments are only known after the
+        # first step, see `_detect_info_keys`
 
-        self.log_episode_return_PERFORMANCE = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_return_BUTTON_PRESSES = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_return_PHONES_CLEANED = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_return_DIRT_CLEANED = torch.zeros(self.num_procs, device=self.device)
+        self._info_keys = None
+        self._info_stages = []
+        self._has_messes = False
+        self._has_performance_full = False
+        self._has_performance = False
+        self._has_button_presses = False
+        self._has_phones_cleaned = False
+        self._has_dirt_cleaned = False
 
-        self.log_episode_return = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_reshaped_return = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_reshaped_return_PERFORMANCE = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_reshaped_return_BUTTON_PRESSES = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_reshaped_return_PHONES_CLEANED = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_reshaped_return_DIRT_CLEANED = torch.zeros(self.num_procs, device=self.device)
-        self.log_episode_num_frames = torch.zeros(self.num_procs, device=self.device)
+        # Initialize log values: all the per-episode values live in a single
+        # NUM_LOGS x P tensor, updated by `_log_episode_step` in one add
+
+        self.log_episode = torch.zeros(NUM_LOGS, self.num_procs, device=self.device)
+        self._log_episode_step = torch.zeros(NUM_LOGS, self.num_procs, device=self.device)
+        self._log_episode_step[LOG_NUM_FRAMES] = 1
+
+        # At most `self.num_frames` episodes end during a rollout, so bounding
+        # the per-episode logs to that many values keeps all the logged ones
 
         self.log_done_counter = 0
-        self.log_return = [0] * self.num_procs
-        self.log_return_MESSES = [0] * self.num_procs
-        self.log_return_PERFORMANCE_FULL = [0] * self.num_procs
-        self.log_return_PERFORMANCE = [0] * self.num_procs
-        self.log_return_BUTTON_PRESSES = [0] * self.num_procs
-        self.log_return_PHONES_CLEANED = [0] * self.num_procs
-        self.log_return_DIRT_CLEANED = [0] * self.num_procs
-        self.log_reshaped_return = [0] * self.num_procs
-        self.log_reshaped_return_PERFORMANCE = [0] * self.num_procs
-        self.log_reshaped_return_BUTTON_PRESSES = [0] * self.num_procs
-        self.log_reshaped_return_PHONES_CLEANED = [0] * self.num_procs
-        self.log_reshaped_return_DIRT_CLEANED = [0] * self.num_procs
-        self.log_num_frames = [0] * self.num_procs
+        self.log_return = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_return_MESSES = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_return_PERFORMANCE_FULL = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_return_PERFORMANCE = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_return_BUTTON_PRESSES = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_return_PHONES_CLEANED = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_return_DIRT_CLEANED = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_reshaped_return = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_reshaped_return_PERFORMANCE = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_reshaped_return_BUTTON_PRESSES = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_reshaped_return_PHONES_CLEANED = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_reshaped_return_DIRT_CLEANED = deque([0] * self.num_procs, maxlen=self.num_frames)
+        self.log_num_frames = deque([0] * self.num_procs, maxlen=self.num_frames)
 
     def collect_experiences(self):
         """Collects rollouts and computes advantages.
@@ -146,190 +280,147 @@ class BaseAlgo(ABC):
             (self.num_frames_per_proc * num_envs, ...). k-th block
             of consecutive `self.num_frames_per_proc` frames contains
             data obtained from the k-th environment. Be careful not to mix
-            data from different environments!
+            data from different environments! The tensors are views of the
+            algo's buffers and are overwritten by the next call.
         logs : dict
             Useful stats about the training process, including the average
             reward, policy loss, value loss, etc.
         """
 
-        hasMesses = False
-        hasPerf = False
-        hasPerfFull = False
-        hasButtonPresses = False
-        hasPhonesCleaned = False
-        hasDirtCleaned = False
-
         addedAllMyData = False
         loggedAllMyData = False
         allMyData = None
 
+        obss_preprocessed = True
+
         for i in range(self.num_frames_per_proc):
             # Do one agent-environment interaction
 
-            preprocessed_obs = self.preprocess_obss(self.obs, device=self.device)
+            preprocessed_obs = self.preprocessed_obs
+            if obss_preprocessed:
+                obss_preprocessed = self._store_preprocessed_obs(i, preprocessed_obs)
             with torch.no_grad():
                 if self.acmodel.recurrent:
-                    dist, value, memory = self.acmodel(preprocessed_obs, self.memory * self.mask.unsqueeze(1))
+                    torch.mul(self.memory, self.mask.unsqueeze(1), out=self._masked_memory)
+                    dist, value, memory = self.acmodel(preprocessed_obs, self._masked_memory)
                 else:
                     dist, value = self.acmodel(preprocessed_obs)
-            action = dist.sample()
-
-            obs, reward, done, info = self.env.step(action.cpu().numpy())
-
-            if 'messes_cleaned' in info[0]:
-                hasMesses = True
-                messes = tuple([i['messes_cleaned'] for i in info])
+                action = dist.sample()
+                log_prob = dist.log_prob(action)
+            self._action_cpu.copy_(action, non_blocking=True)
+            if self._action_copied is not None:
+                # The copy runs on the stream of `self.device`, which may not
+                # be the current CUDA device
+                self._action_copied.record(torch.cuda.current_stream(self.device))
 
-            if 'performance_full' in info[0]:
-                hasPerfFull = True
-                performancesFULL = tuple([i['performance_full'] for i in info])
+            # Update experiences values while the action reaches the host
 
-            if 'performance' in info[0]:
-                hasPerf = True
-                performances = tuple([i['performance'] for i in info])
+            self.obss[i] = self.obs
+            if self.acmodel.recurrent:
+                self.memories[:, i] = self.memory
+                self.memory = memory
+            self.masks[:, i] = self.mask
+            self.actions[:, i] = action
+            self.values[:, i] = value
+            self.log_probs[:, i] = log_prob
 
-            if 'button_presses' in info[0]:
-                hasButtonPresses = True
-                button_presses = tuple([i['button_presses'] for i in info])
+            if self._action_copied is not None:
+                self._action_copied.synchronize()
+            obs, reward, done, info = self.env.step(self._action_cpu_np)
 
-            if 'phones_cleaned' in info[0]:
-                hasPhonesCleaned = True
-                phones_cleaned = tuple([i['phones_cleaned'] for i in info])
+            if self._info_keys is None:
+                self._detect_info_keys(info)
 
-            if 'dirt_cleaned' in info[0]:
-                hasDirtCleaned = True
-                dirt_cleaned = tuple([i['dirt_cleaned'] for i in info])
+            staging = self._host_staging_np
+            staging[STAGE_REWARD] = reward
+            staging[STAGE_MASK] = numpy.logical_not(done)
+            if self._info_keys:
+                staging[self._info_stages] = [[info_[key] for info_ in info] for key in self._info_keys]
+            self._dev_staging.copy_(self._host_staging, non_blocking=True)
 
             # Update experiences values
 
-            self.obss[i] = self.obs
             self.obs = obs
-            if self.acmodel.recurrent:
-                self.memories[i] = self.memory
-                self.memory = memory
-            self.masks[i] = self.mask
-            self.mask = 1 - torch.tensor(done, device=self.device, dtype=torch.float)
-            self.actions[i] = action
-            self.values[i] = value
-            if self.reshape_reward is not None:
-                self.rewards[i] = torch.tensor([
-                    self.reshape_reward(obs_, action_, reward_, done_)
-                    for obs_, action_, reward_, done_ in zip(obs, action, reward, done)
-                ], device=self.device)
-
-                assert False
-            else:
-                self.rewards[i] = torch.tensor(reward, device=self.device)
-                if hasPerf:
-                    self.rewards_PERFORMANCE[i] = torch.tensor(performances, device=self.device)
-                if hasButtonPresses:
-                    self.rewards_BUTTON_PRESSES[i] = torch.tensor(button_presses, device=self.device)
-                if hasPhonesCleaned:
-                    self.rewards_PHONES_CLEANED[i] = torch.tensor(phones_cleaned, device=self.device)
-                if hasDirtCleaned:
-                    self.rewards_DIRT_CLEANED[i] = torch.tensor(dirt_cleaned, device=self.device)
-
-            self.log_probs[i] = dist.log_prob(action)
+            self.preprocessed_obs = self.preprocess_obss(obs, device=self.device)
+            self.mask.copy_(self._dev_staging[STAGE_MASK])
+            self.rewards[:, i] = self._dev_staging[STAGE_REWARD]
+            if self._has_performance:
+                self.rewards_PERFORMANCE[:, i] = self._dev_staging[STAGE_PERFORMANCE]
+            if self._has_button_presses:
+                self.rewards_BUTTON_PRESSES[:, i] = self._dev_staging[STAGE_BUTTON_PRESSES]
+            if self._has_phones_cleaned:
+                self.rewards_PHONES_CLEANED[:, i] = self._dev_staging[STAGE_PHONES_CLEANED]
+            if self._has_dirt_cleaned:
+                self.rewards_DIRT_CLEANED[:, i] = self._dev_staging[STAGE_DIRT_CLEANED]
 
             # Update log values
-            if hasMesses:
-                self.log_episode_return_MESSES += torch.tensor(messes, device=self.device, dtype=torch.float)
-            # Update log values
-            if hasPerfFull:
-                self.log_episode_return_PERFORMANCE_FULL += torch.tensor(performancesFULL, device=self.device,
-                                                                         dtype=torch.float)
-            # Update log values
-            if hasPerf:
-                self.log_episode_return_PERFORMANCE += torch.tensor(performances, device=self.device, dtype=torch.float)
-            # Update log values
-            if hasButtonPresses:
-                self.log_episode_return_BUTTON_PRESSES += torch.tensor(button_presses, device=self.device,
-                                                                       dtype=torch.float)
-            # Update log values
-            if hasPhonesCleaned:
-                self.log_episode_return_PHONES_CLEANED += torch.tensor(phones_cleaned, device=self.device,
-                                                                       dtype=torch.float)
-            # Update log values
-            if hasDirtCleaned:
-                self.log_episode_return_DIRT_CLEANED += torch.tensor(dirt_cleaned, device=self.device,
-                                                                     dtype=torch.float)
-
-            self.log_episode_return += torch.tensor(reward, device=self.device, dtype=torch.float)
-            self.log_episode_reshaped_return += self.rewards[i]
-
-            self.log_episode_reshaped_return_PERFORMANCE += self.rewards_PERFORMANCE[i]
-            self.log_episode_reshaped_return_BUTTON_PRESSES += self.rewards_BUTTON_PRESSES[i]
-            self.log_episode_reshaped_return_PHONES_CLEANED += self.rewards_PHONES_CLEANED[i]
-            self.log_episode_reshaped_return_DIRT_CLEANED += self.rewards_DIRT_CLEANED[i]
-
-            self.log_episode_num_frames += torch.ones(self.num_procs, device=self.device)
-
-            for i, done_ in enumerate(done):
-                if done_:
-                    self.log_done_counter += 1
-
-                    if hasMesses:
-                        self.log_return_MESSES.append(self.log_episode_return_MESSES[i].item())
-
-                    if hasPerfFull:
-                        self.log_return_PERFORMANCE_FULL.append(self.log_episode_return_PERFORMANCE_FULL[i].item())
-
-                    if hasPerf:
-                        self.log_return_PERFORMANCE.append(self.log_episode_return_PERFORMANCE[i].item())
-                        self.log_reshaped_return_PERFORMANCE.append(
-                            self.log_episode_reshaped_return_PERFORMANCE[i].item())
-
-                    if hasPhonesCleaned:
-                        self.log_return_BUTTON_PRESSES.append(self.log_episode_return_BUTTON_PRESSES[i].item())
-                        self.log_reshaped_return_BUTTON_PRESSES.append(
-                            self.log_episode_reshaped_return_BUTTON_PRESSES[i].item())
-
-                    if hasButtonPresses:
-                        self.log_return_PHONES_CLEANED.append(self.log_episode_return_PHONES_CLEANED[i].item())
-                        self.log_reshaped_return_PHONES_CLEANED.append(
-                            self.log_episode_reshaped_return_PHONES_CLEANED[i].item())
-
-                    if hasDirtCleaned:
-                        self.log_return_DIRT_CLEANED.append(self.log_episode_return_DIRT_CLEANED[i].item())
-                        self.log_reshaped_return_DIRT_CLEANED.append(
-                            self.log_episode_reshaped_return_DIRT_CLEANED[i].item())
-
-                    self.log_return.append(self.log_episode_return[i].item())
-                    self.log_reshaped_return.append(self.log_episode_reshaped_return[i].item())
-
-                    self.log_num_frames.append(self.log_episode_num_frames[i].item())
-
-            self.log_episode_return *= self.mask
-            self.log_episode_return_PERFORMANCE_FULL *= self.mask
-            self.log_episode_return_MESSES *= self.mask
-            self.log_episode_return_PERFORMANCE *= self.mask
-            self.log_episode_return_BUTTON_PRESSES *= self.mask
-            self.log_episode_return_PHONES_CLEANED *= self.mask
-            self.log_episode_return_DIRT_CLEANED *= self.mask
-
-            self.log_episode_reshaped_return *= self.mask
-            self.log_episode_reshaped_return_PERFORMANCE *= self.mask
-            self.log_episode_reshaped_return_BUTTON_PRESSES *= self.mask
-            self.log_episode_reshaped_return_PHONES_CLEANED *= self.mask
-            self.log_episode_reshaped_return_DIRT_CLEANED *= self.mask
-            self.log_episode_num_frames *= self.mask
+
+            # The reward components are never reshaped, so their reshaped
+            # returns accumulate the same staging rows as their returns
+
+            self._log_episode_step[:LOG_RESHAPED_RETURN] = self._dev_staging[:STAGE_MASK]
+            self._log_episode_step[LOG_RESHAPED_RETURN] = self.rewards[:, i]
+            self._log_episode_step[LOG_RESHAPED_RETURN_PERFORMANCE:LOG_NUM_FRAMES] = \
+                self._dev_staging[STAGE_PERFORMANCE:STAGE_MASK]
+            self.log_episode += self._log_episode_step
+
+            # Fetch the log values of all the finished episodes in one transfer
+
+            done_indexes = numpy.flatnonzero(done)
+            if len(done_indexes) > 0:
+                self.log_done_counter += len(done_indexes)
+                done_logs = self.log_episode[:, torch.from_numpy(done_indexes)].tolist()
+
+                if self._has_messes:
+                    self.log_return_MESSES.extend(done_logs[LOG_RETURN_MESSES])
+
+                if self._has_performance_full:
+                    self.log_return_PERFORMANCE_FULL.extend(done_logs[LOG_RETURN_PERFORMANCE_FULL])
+
+                if self._has_performance:
+                    self.log_return_PERFORMANCE.extend(done_logs[LOG_RETURN_PERFORMANCE])
+                    self.log_reshaped_return_PERFORMANCE.extend(done_logs[LOG_RESHAPED_RETURN_PERFORMANCE])
+
+                if self._has_button_presses:
+                    self.log_return_BUTTON_PRESSES.extend(done_logs[LOG_RETURN_BUTTON_PRESSES])
+                    self.log_reshaped_return_BUTTON_PRESSES.extend(done_logs[LOG_RESHAPED_RETURN_BUTTON_PRESSES])
+
+                if self._has_phones_cleaned:
+                    self.log_return_PHONES_CLEANED.extend(done_logs[LOG_RETURN_PHONES_CLEANED])
+                    self.log_reshaped_return_PHONES_CLEANED.extend(done_logs[LOG_RESHAPED_RETURN_PHONES_CLEANED])
+
+                if self._has_dirt_cleaned:
+                    self.log_return_DIRT_CLEANED.extend(done_logs[LOG_RETURN_DIRT_CLEANED])
+                    self.log_reshaped_return_DIRT_CLEANED.extend(done_logs[LOG_RESHAPED_RETURN_DIRT_CLEANED])
+
+                self.log_return.extend(done_logs[LOG_RETURN])
+                self.log_reshaped_return.extend(done_logs[LOG_RESHAPED_RETURN])
+
+                self.log_num_frames.extend(done_logs[LOG_NUM_FRAMES])
+
+            self.log_episode *= self.mask
 
         # Add advantage and return to experiences
 
-        preprocessed_obs = self.preprocess_obss(self.obs, device=self.device)
+        preprocessed_obs = self.preprocessed_obs
         with torch.no_grad():
             if self.acmodel.recurrent:
-                _, next_value, _ = self.acmodel(preprocessed_obs, self.memory * self.mask.unsqueeze(1))
+                torch.mul(self.memory, self.mask.unsqueeze(1), out=self._masked_memory)
+                _, next_value, _ = self.acmodel(preprocessed_obs, self._masked_memory)
             else:
                 _, next_value = self.acmodel(preprocessed_obs)
 
-        for i in reversed(range(self.num_frames_per_proc)):
-            next_mask = self.masks[i + 1] if i < self.num_frames_per_proc - 1 else self.mask
-            next_value = self.values[i + 1] if i < self.num_frames_per_proc - 1 else next_value
-            next_advantage = self.advantages[i + 1] if i < self.num_frames_per_proc - 1 else 0
+        # All the deltas are computed at once, only the advantage recursion
+        # remains sequential over T
 
-            delta = self.rewards[i] + self.discount * next_value * next_mask - self.values[i]
-            self.advantages[i] = delta + self.discount * self.gae_lambda * next_advantage * next_mask
+        next_values = torch.cat([self.values[:, 1:], next_value.unsqueeze(1)], 1)
+        next_masks = torch.cat([self.masks[:, 1:], self.mask.unsqueeze(1)], 1)
+        deltas = self.rewards + self.discount * next_values * next_masks - self.values
+        gae_coefs = self.discount * self.gae_lambda * next_masks
+
+        self.advantages[:, -1] = deltas[:, -1]
+        for i in range(self.num_frames_per_proc - 2, -1, -1):
+            self.advantages[:, i] = deltas[:, i] + gae_coefs[:, i] * self.advantages[:, i + 1]
 
         # Define experiences:
         #   the whole experience is the concatenation of the experience
@@ -340,62 +431,106 @@ class BaseAlgo(ABC):
         #   - D is the dimensionality.
 
         exps = DictList()
-        exps.obs = [self.obss[i][j]
-                    for j in range(self.num_procs)
-                    for i in range(self.num_frames_per_proc)]
+        if obss_preprocessed:
+            # P x T x D -> (P * T) x D
+            obs_fields = {key: obss.reshape(-1, *obss.shape[2:])
+                          for key, obss in self.preprocessed_obss.items()}
+            exps.obs = obs_fields[None] if None in obs_fields else DictList(obs_fields)
+        else:
+            exps.obs = self.preprocess_obss([self.obss[i][j]
+                                             for j in range(self.num_procs)
+                                             for i in range(self.num_frames_per_proc)], device=self.device)
         if self.acmodel.recurrent:
-            # T x P x D -> P x T x D -> (P * T) x D
-            exps.memory = self.memories.transpose(0, 1).reshape(-1, *self.memories.shape[2:])
-            # T x P -> P x T -> (P * T) x 1
-            exps.mask = self.masks.transpose(0, 1).reshape(-1).unsqueeze(1)
-        # for all tensors below, T x P -> P x T -> P * T
-        exps.action = self.actions.transpose(0, 1).reshape(-1)
-        exps.value = self.values.transpose(0, 1).reshape(-1)
-        exps.reward = self.rewards.transpose(0, 1).reshape(-1)
-        exps.advantage = self.advantages.transpose(0, 1).reshape(-1)
+            # P x T x D -> (P * T) x D
+            exps.memory = self.memories.reshape(-1, *self.memories.shape[2:])
+            # P x T -> (P * T) x 1
+            exps.mask = self.masks.reshape(-1).unsqueeze(1)
+        # for all tensors below, P x T -> P * T
+        exps.action = self.actions.reshape(-1)
+        exps.value = self.values.reshape(-1)
+        exps.reward = self.rewards.reshape(-1)
+        exps.advantage = self.advantages.reshape(-1)
         exps.returnn = exps.value + exps.advantage
-        exps.log_prob = self.log_probs.transpose(0, 1).reshape(-1)
-
-        # Preprocess experiences
-
-        exps.obs = self.preprocess_obss(exps.obs, device=self.device)
+        exps.log_prob = self.log_probs.reshape(-1)
 
         # Log some values
 
         keep = max(self.log_done_counter, self.num_procs)
 
         logs = {
-            "return_per_episode": self.log_return[-keep:],
-            "reshaped_return_per_episode": self.log_reshaped_return[-keep:],
-            "num_frames_per_episode": self.log_num_frames[-keep:],
+            "return_per_episode": list(self.log_return)[-keep:],
+            "reshaped_return_per_episode": list(self.log_reshaped_return)[-keep:],
+            "num_frames_per_episode": list(self.log_num_frames)[-keep:],
             "num_frames": self.num_frames,
 
-            "messes_per_episode": self.log_return_MESSES[-keep:],
-            "performance_full_per_episode": self.log_return_PERFORMANCE_FULL[-keep:],
+            "messes_per_episode": list(self.log_return_MESSES)[-keep:],
+            "performance_full_per_episode": list(self.log_return_PERFORMANCE_FULL)[-keep:],
 
-            "performance_per_episode": self.log_return_PERFORMANCE[-keep:],
-            "reshaped_performance_per_episode": self.log_reshaped_return_PERFORMANCE[-keep:],
+            "performance_per_episode": list(self.log_return_PERFORMANCE)[-keep:],
+            "reshaped_performance_per_episode": list(self.log_reshaped_return_PERFORMANCE)[-keep:],
 
-            "buttons_per_episode": self.log_return_BUTTON_PRESSES[-keep:],
-            "reshaped_buttons_per_episode": self.log_reshaped_return_BUTTON_PRESSES[-keep:],
+            "buttons_per_episode": list(self.log_return_BUTTON_PRESSES)[-keep:],
+            "reshaped_buttons_per_episode": list(self.log_reshaped_return_BUTTON_PRESSES)[-keep:],
 
-            "phones_per_episode": self.log_return_PHONES_CLEANED[-keep:],
-            "reshaped_phones_per_episode": self.log_reshaped_return_PHONES_CLEANED[-keep:],
+            "phones_per_episode": list(self.log_return_PHONES_CLEANED)[-keep:],
+            "reshaped_phones_per_episode": list(self.log_reshaped_return_PHONES_CLEANED)[-keep:],
 
-            "dirt_per_episode": self.log_return_DIRT_CLEANED[-keep:],
-            "reshaped_dirt_per_episode": self.log_reshaped_return_DIRT_CLEANED[-keep:],
+            "dirt_per_episode": list(self.log_return_DIRT_CLEANED)[-keep:],
+            "reshaped_dirt_per_episode": list(self.log_reshaped_return_DIRT_CLEANED)[-keep:],
             "numberOfPermutes": info[0]['numberOfPermutes'],
             "buttonValue": info[0]['buttonValue'],
             "episodesDone": self.log_done_counter,
         }
 
         self.log_done_counter = 0
-        self.log_return = self.log_return[-self.num_procs:]
-        self.log_reshaped_return = self.log_reshaped_return[-self.num_procs:]
-        self.log_num_frames = self.log_num_frames[-self.num_procs:]
 
         return exps, logs
 
+    def _detect_info_keys(self, info):
+        """Finds which of the `INFO_STAGES` keys the environments report in
+        their infos. They are assumed not to change during training."""
+
+        self._info_keys = [key for key in INFO_STAGES if key in info[0]]
+        self._info_stages = [INFO_STAGES[key] for key in self._info_keys]
+
+        self._has_messes = 'messes_cleaned' in self._info_keys
+        self._has_performance_full = 'performance_full' in self._info_keys
+        self._has_performance = 'performance' in self._info_keys
+        self._has_button_presses = 'button_presses' in self._info_keys
+        self._has_phones_cleaned = 'phones_cleaned' in self._info_keys
+        self._has_dirt_cleaned = 'dirt_cleaned' in self._info_keys
+
+    def _store_preprocessed_obs(self, i, preprocessed_obs):
+        """Writes the observations preprocessed at step `i` into the
+        P x T x D buffers of `self.preprocessed_obss`, (re)allocated at
+        step 0 if needed.
+
+        Returns
+        -------
+        stored : bool
+            False if the observations do not fit the buffers, e.g. texts
+            padded to a different length than at step 0. The observations
+            then have to be preprocessed again at the end of the rollout.
+        """
+
+        fields = _obs_fields(preprocessed_obs)
+        if i == 0:
+            self.preprocessed_obss = {key: self.preprocessed_obss.get(key) for key in fields}
+
+        for key, value in fields.items():
+            if not torch.is_tensor(value):
+                return False
+            shape = (value.shape[0], self.num_frames_per_proc, *value.shape[1:])
+            buffer = self.preprocessed_obss.get(key)
+            if buffer is None or buffer.shape != shape or buffer.dtype != value.dtype:
+                if i > 0:
+                    return False
+                buffer = torch.zeros(*shape, dtype=value.dtype, device=value.device)
+                self.preprocessed_obss[key] = buffer
+            buffer[:, i] = value
+
+        return True
+
     @abstractmethod
     def update_parameters(self):
         pass
@@ -1,4 +1,9 @@
+import numpy
 import torch
 
 def default_preprocess_obss(obss, device=None):
-    return torch.tensor(obss, device=device)
\ No newline at end of file
+    # Stacking arrays with numpy is much faster than torch.tensor on a list
+    # of arrays and keeps their dtype
+    if len(obss) > 0 and isinstance(obss[0], numpy.ndarray):
+        return torch.as_tensor(numpy.array(obss), device=device)
+    return torch.tensor(obss, device=device)
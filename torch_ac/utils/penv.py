@@ -1,35 +1,47 @@
 from multiprocessing import Process, Pipe
 import gym
+import numpy
 
-def worker(conn, env):
+def step_envs(envs, actions):
+    results = []
+    for env, action in zip(envs, actions):
+        obs, reward, done, info = env.step(action)
+        if done:
+            obs = env.reset()
+        results.append((obs, reward, done, info))
+    return results
+
+def worker(conn, envs):
     while True:
         cmd, data = conn.recv()
         if cmd == "step":
-            obs, reward, done, info = env.step(data)
-            if done:
-                obs = env.reset()
-            conn.send((obs, reward, done, info))
+            conn.send(step_envs(envs, data))
         elif cmd == "reset":
-            obs = env.reset()
-            conn.send(obs)
+            conn.send([env.reset() for env in envs])
         else:
             raise NotImplementedError
 
 class ParallelEnv(gym.Env):
-    """A concurrent execution of environments in multiple processes."""
+    """A concurrent execution of environments in multiple processes.
+
+    The environments are split into groups of `envs_per_process`
+    environments, each group being stepped by one process in a single
+    round trip. The first group is stepped by the calling process."""
 
-    def __init__(self, envs):
+    def __init__(self, envs, envs_per_process=1):
         assert len(envs) >= 1, "No environment given."
+        assert envs_per_process >= 1, "At least one environment per process is needed."
 
         self.envs = envs
+        self.envs_per_process = envs_per_process
         self.observation_space = self.envs[0].observation_space
         self.action_space = self.envs[0].action_space
 
         self.locals = []
-        for env in self.envs[1:]:
+        for start in range(envs_per_process, len(self.envs), envs_per_process):
             local, remote = Pipe()
             self.locals.append(local)
-            p = Process(target=worker, args=(remote, env))
+            p = Process(target=worker, args=(remote, self.envs[start:start + envs_per_process]))
             p.daemon = True
             p.start()
             remote.close()
@@ -37,17 +49,23 @@ class ParallelEnv(gym.Env):
     def reset(self):
         for local in self.locals:
             local.send(("reset", None))
-        results = [self.envs[0].reset()] + [local.recv() for local in self.locals]
+        results = [env.reset() for env in self.envs[:self.envs_per_process]]
+        for local in self.locals:
+            results.extend(local.recv())
         return results
 
     def step(self, actions):
-        for local, action in zip(self.locals, actions[1:]):
-            local.send(("step", action))
-        obs, reward, done, info = self.envs[0].step(actions[0])
-        if done:
-            obs = self.envs[0].reset()
-        results = zip(*[(obs, reward, done, info)] + [local.recv() for local in self.locals])
-        return results
+        """Steps all the environments and returns the list of observations,
+        the rewards and done flags as numpy arrays and the list of infos."""
+
+        n = self.envs_per_process
+        for k, local in enumerate(self.locals):
+            local.send(("step", actions[(k + 1) * n:(k + 2) * n]))
+        results = step_envs(self.envs[:n], actions[:n])
+        for local in self.locals:
+            results.extend(local.recv())
+        obs, reward, done, info = zip(*results)
+        return list(obs), numpy.array(reward, dtype=numpy.float32), numpy.array(done, dtype=bool), list(info)
 
     def render(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError